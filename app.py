@@ -1,11 +1,21 @@
-import gspread
-from google.oauth2.service_account import Credentials
-from flask import Flask, jsonify, send_from_directory
+from flask import Flask, send_from_directory, request, Response, stream_with_context
 from lxml import etree
 import os
 import logging
 from dotenv import load_dotenv
 import json
+import re
+import pickle
+from functools import lru_cache
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from collections import OrderedDict
+import threading
+import uuid
+import hashlib
+import gzip
+import shutil
+import time
+import orjson
 
 # --- Load environment variables ---
 load_dotenv()
@@ -14,11 +24,13 @@ load_dotenv()
 SCOPE = ['https://spreadsheets.google.com/feeds', 'https://www.googleapis.com/auth/drive']
 CREDENTIALS_FILE = os.getenv('GOOGLE_CREDENTIALS_PATH', 'credentials.json')
 SPREADSHEET_NAME = os.getenv('SPREADSHEET_NAME')
+# Opening by ID skips the Drive search that resolving a name needs
+SPREADSHEET_ID = os.getenv('SPREADSHEET_ID')
 WORKSHEET_NAME = os.getenv('WORKSHEET_NAME')
 
 # Validate required environment variables
-if not SPREADSHEET_NAME:
-    raise ValueError("SPREADSHEET_NAME environment variable is required")
+if not SPREADSHEET_NAME and not SPREADSHEET_ID:
+    raise ValueError("SPREADSHEET_NAME or SPREADSHEET_ID environment variable is required")
 if not WORKSHEET_NAME:
     raise ValueError("WORKSHEET_NAME environment variable is required")
 
@@ -26,14 +38,69 @@ if not WORKSHEET_NAME:
 XSD_VENDOR_ID_MAX_LENGTH = 64
 XSD_ATTRIBUTE_NAME_MAX_LENGTH = 32
 XSD_ATTRIBUTE_VALUE_MAX_LENGTH = 32
-XSD_ALLOWED_PRICE_TYPES = {
+XSD_ALLOWED_PRICE_TYPES = frozenset({
     "FIXED_PRICE", "BIDDING", "NEGOTIABLE", "NOT_APPLICABLE",
     "CREDIBLE_BID", "SWAP", "FREE", "RESERVED",
     "SEE_DESCRIPTION", "ON_DEMAND", "BIDDING_FROM"
-}
+})
+TYPES_REQUIRING_PRICE = frozenset({'FIXED_PRICE', 'BIDDING_FROM'})
+REQUIRED_FIELDS = ('vendorId', 'title', 'description', 'categoryId', 'priceType')
+
+NS = "http://admarkt.marktplaats.nl/schemas/1.0"
+NSMAP = {'admarkt': NS}
+TAG_AD = f"{{{NS}}}ad"
+TAG_VENDOR_ID = f"{{{NS}}}vendorId"
+TAG_TITLE = f"{{{NS}}}title"
+TAG_DESCRIPTION = f"{{{NS}}}description"
+TAG_CATEGORY_ID = f"{{{NS}}}categoryId"
+TAG_PRICE_TYPE = f"{{{NS}}}priceType"
+TAG_PRICE = f"{{{NS}}}price"
+TAG_URL = f"{{{NS}}}url"
+TAG_MEDIA = f"{{{NS}}}media"
+TAG_IMAGE = f"{{{NS}}}image"
+TAG_ATTRIBUTES = f"{{{NS}}}attributes"
+TAG_ATTRIBUTE = f"{{{NS}}}attribute"
+TAG_ATTRIBUTE_NAME = f"{{{NS}}}attributeName"
+TAG_ATTRIBUTE_VALUE = f"{{{NS}}}attributeValue"
+
+# Compact output is written as plain text; these mirror lxml's serialization exactly
+FEED_HEADER = f"<?xml version='1.0' encoding='UTF-8'?>\n<admarkt:ads xmlns:admarkt=\"{NS}\">"
+FEED_FOOTER = "</admarkt:ads>"
+
+AVAILABLE_VALUES = frozenset({'TRUE', 'YES', '1'})
+# Common raw spellings accepted without strip()/upper()
+AVAILABLE_RAW_VALUES = AVAILABLE_VALUES | {'True', 'true', 'Yes', 'yes'}
 
 ATTRIBUTE_COLUMNS = ['area_sqm', 'property_type', 'deal_type']
-IMAGE_COLUMNS = ['img_2', 'img_3', 'img_4', 'img_5', 'img_6', 'img_7', 'img_8', 'img_9', 'img_10']
+IMAGE_COLUMNS = ('img_2', 'img_3', 'img_4', 'img_5', 'img_6', 'img_7', 'img_8', 'img_9', 'img_10')
+# Main image first, then the additional image columns
+ALL_IMAGE_COLUMNS = ('image_link',) + IMAGE_COLUMNS
+HTTP_PREFIXES = ('http://', 'https://')
+
+TEMPLATE_TAGS = [
+    '{{Centre_description}}', '{{center_name}}', '{{price}}',
+    '{{currency}}', '{{area_Min}}', '{{area_Max}}'
+]
+TAG_RE = re.compile('|'.join(map(re.escape, TEMPLATE_TAGS)))
+TAG_TEXT_FIELDS = ['title', 'Centre_description', 'preheader', 'description']
+
+# Every sheet column the feed reads; other columns are dropped when rows are loaded
+USED_COLUMNS = frozenset(
+    list(REQUIRED_FIELDS)
+    + ['price', 'url', 'Available', 'preheader', 'Centre_description', 'center_name', 'price (mirror)', 'area_max']
+    + ATTRIBUTE_COLUMNS + list(ALL_IMAGE_COLUMNS)
+)
+
+MULTI_NEWLINE_RE = re.compile(r'\n{3,}')
+# Characters lxml refuses to serialize (C0 controls other than tab/LF/CR, surrogates, U+FFFE/FFFF)
+INVALID_XML_CHARS_RE = re.compile('[\x00-\x08\x0b\x0c\x0e-\x1f\ud800-\udfff\ufffe\uffff]')
+
+# Sheets at least this large are processed in a worker process pool, when
+# more than one CPU is available
+PARALLEL_MIN_ROWS = int(os.getenv('PARALLEL_MIN_ROWS', '2000'))
+
+# The feed is machine-read; indentation only adds bytes. Set PRETTY_XML=1 to debug
+PRETTY_XML = os.getenv('PRETTY_XML', '0') == '1'
 
 # --- Logging setup ---
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -61,85 +128,287 @@ if cloudinary_cloud_name and cloudinary_api_key and cloudinary_api_secret:
 else:
     logger.warning("Cloudinary not configured. Upload will be unavailable.")
 
+CLOUDINARY_CHUNK_SIZE = 6_000_000
+
 # --- Flask app ---
 app = Flask(__name__)
 
 # --- Local storage ---
 XML_STORAGE_DIR = 'xml_files'
+LATEST_XML_PATH = os.path.join(XML_STORAGE_DIR, "latest.xml")
+XML_CACHE_MAX_AGE = 300
+# Content hash of latest.xml, shared with every worker through a sidecar file
+LATEST_ETAG_PATH = f"{LATEST_XML_PATH}.etag"
+# Pre-compressed copy served to clients that accept gzip
+LATEST_GZIP_NAME = "latest.xml.gz"
+# A compiled XSD keeps its error_log on the object; validate one document at a time
+_SCHEMA_LOCK = threading.Lock()
 os.makedirs(XML_STORAGE_DIR, exist_ok=True)
 
+# --- Background feed jobs (one generation at a time, recent jobs kept for polling) ---
+FEED_EXECUTOR = ThreadPoolExecutor(max_workers=1)
+MAX_TRACKED_JOBS = 20
+_JOBS = OrderedDict()
+_JOBS_LOCK = threading.Lock()
+# Cloudinary uploads run after generation, keyed by the job that produced the feed
+UPLOAD_EXECUTOR = ThreadPoolExecutor(max_workers=1)
+_UPLOADS = OrderedDict()
+# ETag of the feed last uploaded successfully, so unchanged feeds aren't re-sent
+_LAST_UPLOAD = {'etag': None, 'result': None}
+
+# Sheet caches hand back the same list object while the sheet is unchanged
+_LAST_GENERATION = {'records': None, 'result': None}
+# Progress of the running generation; only one runs at a time
+_FEED_PROGRESS = {'stage': 'idle', 'rows_done': 0, 'total_rows': 0}
+PROGRESS_STREAM_INTERVAL = 2
+
+# --- Google Sheets client (authorized once, shared across requests) ---
+_GS_CLIENT = None
+_GS_CLIENT_LOCK = threading.Lock()
+# Spreadsheet/worksheet handles opened with the shared client
+_GS_HANDLES = {'spreadsheet': None, 'worksheet': None}
+
+# --- Sheet cache (keyed by spreadsheet modifiedTime) ---
+SHEET_CACHE_PATH = os.path.join(XML_STORAGE_DIR, 'sheet_cache.pkl')
+# Bump whenever fetch_sheet_records changes the shape or content of the records,
+# so a pickle written by an older deploy is not reused
+SHEET_CACHE_FORMAT = 1
+_SHEET_CACHE = {'key': None, 'records': None}
+
+# Within the TTL, records are served without contacting Google at all
+SHEET_CACHE_TTL = int(os.getenv('SHEET_CACHE_TTL', '60'))
+_SHEET_TTL_CACHE = {'ts': 0.0, 'records': None}
+_SHEET_FETCH_LOCK = threading.Lock()
+
+
+def load_sheet_cache(cache_key):
+    """Returns cached records for the given sheet revision, or None."""
+    if _SHEET_CACHE['key'] != cache_key and os.path.exists(SHEET_CACHE_PATH):
+        try:
+            with open(SHEET_CACHE_PATH, 'rb') as f:
+                _SHEET_CACHE.update(pickle.load(f))
+        except Exception as e:
+            logger.warning(f"Sheet cache read error: {e}")
+    
+    if _SHEET_CACHE['key'] == cache_key:
+        return _SHEET_CACHE['records']
+    return None
+
+
+def save_sheet_cache(cache_key, records):
+    """Stores records in memory and on disk for the given sheet revision."""
+    _SHEET_CACHE.update(key=cache_key, records=records)
+    try:
+        with open(SHEET_CACHE_PATH, 'wb') as f:
+            pickle.dump(_SHEET_CACHE, f, protocol=pickle.HIGHEST_PROTOCOL)
+    except Exception as e:
+        logger.warning(f"Sheet cache write error: {e}")
+
+
+def invalidate_sheet_cache():
+    """Clears the TTL and revision caches so the next fetch hits Google Sheets."""
+    with _SHEET_FETCH_LOCK:
+        _SHEET_TTL_CACHE.update(ts=0.0, records=None)
+        _SHEET_CACHE.update(key=None, records=None)
+        _LAST_GENERATION.update(records=None, result=None)
+        if os.path.exists(SHEET_CACHE_PATH):
+            os.remove(SHEET_CACHE_PATH)
+
+
+def get_gspread_client():
+    """Returns the shared authorized gspread client, creating it on first use."""
+    global _GS_CLIENT
+    with _GS_CLIENT_LOCK:
+        if _GS_CLIENT is None:
+            if not os.path.exists(CREDENTIALS_FILE):
+                raise FileNotFoundError(f"credentials.json not found at: {CREDENTIALS_FILE}")
+            
+            # Validate credentials file
+            with open(CREDENTIALS_FILE, 'r') as f:
+                creds_data = json.load(f)
+                if creds_data.get('type') != 'service_account':
+                    raise ValueError("Invalid service account credentials format")
+            
+            # Imported on first use: gspread and google.oauth2 add noticeably to cold start
+            import gspread
+            from google.oauth2.service_account import Credentials
+            
+            creds = Credentials.from_service_account_file(CREDENTIALS_FILE, scopes=SCOPE)
+            _GS_CLIENT = gspread.authorize(creds)
+            logger.info("Google Sheets client authorized")
+        return _GS_CLIENT
+
+
+def reset_gspread_client():
+    """Drops the shared gspread client so the next call re-authorizes."""
+    global _GS_CLIENT
+    with _GS_CLIENT_LOCK:
+        _GS_CLIENT = None
+        _GS_HANDLES.update(spreadsheet=None, worksheet=None)
+
+
+def get_spreadsheet(client):
+    """Returns the spreadsheet handle, opening it once per client."""
+    if _GS_HANDLES['spreadsheet'] is None:
+        if SPREADSHEET_ID:
+            _GS_HANDLES['spreadsheet'] = client.open_by_key(SPREADSHEET_ID)
+        else:
+            _GS_HANDLES['spreadsheet'] = client.open(SPREADSHEET_NAME)
+    return _GS_HANDLES['spreadsheet']
+
+
+def get_worksheet(spreadsheet):
+    """Returns the worksheet handle, looking it up once per spreadsheet handle."""
+    if _GS_HANDLES['worksheet'] is None:
+        _GS_HANDLES['worksheet'] = spreadsheet.worksheet(WORKSHEET_NAME)
+    return _GS_HANDLES['worksheet']
+
+
+def fetch_sheet_records(client):
+    """Reads the worksheet as a list of dicts, reusing the cache when unchanged."""
+    spreadsheet = get_spreadsheet(client)
+    
+    # Cheap Drive metadata probe; skip the values pull if nothing changed
+    cache_key = (SHEET_CACHE_FORMAT, SPREADSHEET_ID or SPREADSHEET_NAME, WORKSHEET_NAME, spreadsheet.get_lastUpdateTime())
+    cached_records = load_sheet_cache(cache_key)
+    if cached_records is not None:
+        logger.info(f"Sheet unchanged, using {len(cached_records)} cached records")
+        return cached_records
+    
+    sheet = get_worksheet(spreadsheet)
+    # One values.get call; headers are zipped onto rows locally. Formatted
+    # values keep the text the sheet displays (currency, thousands separators),
+    # which template tags copy into titles and descriptions; to_int parses numbers
+    rows = sheet.get_values(value_render_option='FORMATTED_VALUE')
+    headers = rows[0] if rows else []
+    # Column positions are resolved once; rows only carry the columns the feed uses
+    used_columns = [(idx, name) for idx, name in enumerate(headers) if name in USED_COLUMNS]
+    records = [
+        {name: row[idx] for idx, name in used_columns if idx < len(row)}
+        for row in rows[1:]
+    ]
+    save_sheet_cache(cache_key, records)
+    
+    logger.info(f"Retrieved {len(records)} records")
+    return records
+
+
+def is_auth_error(error):
+    """True for errors that a freshly authorized client could fix."""
+    from google.auth.exceptions import RefreshError
+    from gspread.exceptions import APIError
+    if isinstance(error, RefreshError):
+        return True
+    return isinstance(error, APIError) and error.response.status_code == 401
+
 
 def get_sheet_data():
     """Connects to Google Sheets and retrieves data."""
-    try:
-        logger.info("Connecting to Google Sheets...")
-        
-        if not os.path.exists(CREDENTIALS_FILE):
-            raise FileNotFoundError(f"credentials.json not found at: {CREDENTIALS_FILE}")
-        
-        # Validate credentials file
-        with open(CREDENTIALS_FILE, 'r') as f:
-            creds_data = json.load(f)
-            if creds_data.get('type') != 'service_account':
-                raise ValueError("Invalid service account credentials format")
+    # The lock also stops concurrent requests from fetching the same sheet twice
+    with _SHEET_FETCH_LOCK:
+        age = time.monotonic() - _SHEET_TTL_CACHE['ts']
+        if _SHEET_TTL_CACHE['records'] is not None and age < SHEET_CACHE_TTL:
+            logger.info(f"Using sheet records fetched {age:.0f}s ago")
+            return _SHEET_TTL_CACHE['records']
         
-        creds = Credentials.from_service_account_file(CREDENTIALS_FILE, scopes=SCOPE)
-        client = gspread.authorize(creds)
-        sheet = client.open(SPREADSHEET_NAME).worksheet(WORKSHEET_NAME)
-        records = sheet.get_all_records()
+        try:
+            logger.info("Connecting to Google Sheets...")
+            
+            try:
+                records = fetch_sheet_records(get_gspread_client())
+            except Exception as e:
+                if not is_auth_error(e):
+                    raise
+                # Token refresh failed or was rejected on the cached client; re-authorize once
+                logger.warning(f"Google authorization failed, re-authorizing: {e}")
+                reset_gspread_client()
+                records = fetch_sheet_records(get_gspread_client())
+            
+        except Exception as e:
+            logger.error(f"Google Sheets error: {e}")
+            # The sheet may have been renamed or deleted; reopen it next time
+            _GS_HANDLES.update(spreadsheet=None, worksheet=None)
+            raise
         
-        logger.info(f"Retrieved {len(records)} records")
+        _SHEET_TTL_CACHE.update(ts=time.monotonic(), records=records)
         return records
-        
-    except Exception as e:
-        logger.error(f"Google Sheets error: {e}")
-        raise
+
+
+def is_available(value):
+    """True if an Available cell marks the row as active."""
+    # Sheet cells arrive as display strings, so the common spellings match
+    # without upper(); a bool True is accepted too, and the identity check
+    # keeps 1/1.0 from matching the way set membership would
+    return (value is True or value in AVAILABLE_RAW_VALUES
+            or str(value).strip().upper() in AVAILABLE_VALUES)
 
 
 def validate_record(record):
     """Checks required fields."""
-    required_fields = ['vendorId', 'title', 'description', 'categoryId', 'priceType']
-    
-    for field in required_fields:
-        if not record.get(field):
+    for field in REQUIRED_FIELDS:
+        value = record.get(field)
+        # Whitespace-only cells would clean to an empty element; reject them here
+        if not value or (type(value) is str and not value.strip()):
             return False, f"missing '{field}'"
     
     return True, None
 
 
-def validate_xsd_constraints(record):
-    """Validates XSD constraints."""
+def validate_xsd_constraints(record, price_type):
+    """Validates XSD constraints. Returns (is_valid, error, parsed categoryId).
+    
+    price_type is the record's priceType, already stripped and upper-cased.
+    """
     vendor_id = str(record.get('vendorId', ''))
     if len(vendor_id) > XSD_VENDOR_ID_MAX_LENGTH:
-        return False, f"vendorId too long ({len(vendor_id)} > {XSD_VENDOR_ID_MAX_LENGTH})"
+        return False, f"vendorId too long ({len(vendor_id)} > {XSD_VENDOR_ID_MAX_LENGTH})", None
     
-    price_type = str(record.get('priceType', '')).upper()
     if price_type and price_type not in XSD_ALLOWED_PRICE_TYPES:
-        return False, f"invalid priceType: '{price_type}'"
+        return False, f"invalid priceType: '{price_type}'", None
     
     try:
-        category_id = int(float(record.get('categoryId')))
+        category_id = to_int(record.get('categoryId'))
         if category_id <= 0:
-            return False, f"categoryId must be positive, got: {category_id}"
+            return False, f"categoryId must be positive, got: {category_id}", None
     except (ValueError, TypeError):
-        return False, f"invalid categoryId: '{record.get('categoryId')}'"
+        return False, f"invalid categoryId: '{record.get('categoryId')}'", None
     
-    return True, None
+    return True, None, category_id
+
+
+def to_int(value):
+    """Parses an integer, falling back to float parsing for values like '12.0'."""
+    if type(value) is int:
+        return value
+    if type(value) is float:
+        return int(value)
+    if type(value) is str and '.' in value:
+        # Decimal strings go straight to float instead of via a failed int()
+        return int(float(value))
+    try:
+        return int(value)
+    except (ValueError, TypeError):
+        return int(float(value))
 
 
 def clean_text(text):
     """Cleans text for XML."""
-    if text is None or str(text).strip() == '':
+    if text is None:
         return ""
-    return str(text).strip()
+    return text.strip() if type(text) is str else str(text).strip()
 
 
+@lru_cache(maxsize=2048)
 def format_text_for_marktplaats(text):
     """Formats text with HTML tags."""
     if not text:
         return ""
     
-    s = str(text).replace('\r\n', '\n').replace('\r', '\n').strip()
+    s = str(text)
+    # Sheets text is normally LF-only; only normalize when a CR is present
+    if '\r' in s:
+        s = s.replace('\r\n', '\n').replace('\r', '\n')
+    s = s.strip()
     if not s:
         return ""
     
@@ -148,8 +417,7 @@ def format_text_for_marktplaats(text):
     
     if contains_html:
         # Collapse multiple newlines
-        while '\n\n\n' in s:
-            s = s.replace('\n\n\n', '\n\n')
+        s = MULTI_NEWLINE_RE.sub('\n\n', s)
         s = s.replace('\n\n', '<br><br>').replace('\n', '<br>')
         return s
     
@@ -167,37 +435,35 @@ def format_text_for_marktplaats(text):
     return ''.join(html_parts)
 
 
-def is_valid_url(url):
-    """Validates URL format."""
+def clean_url(url):
+    """Returns the stripped URL if it is an http(s) URL, otherwise None."""
     if not url:
-        return False
-    url_str = str(url).strip()
-    return url_str.startswith(('http://', 'https://'))
+        return None
+    url_str = url.strip() if type(url) is str else str(url).strip()
+    return url_str if url_str.startswith(HTTP_PREFIXES) else None
 
 
 def get_attribute_value_with_fallback(key, value):
-    """Applies fallback for specific attributes."""
+    """Applies fallback for specific attributes. value is already clean_text()-ed."""
     if key == 'area_sqm':
-        if not value or str(value).strip() == '':
+        if not value:
             return '1'
         try:
-            numeric_value = int(float(value))
+            numeric_value = to_int(value)
             return '1' if numeric_value <= 0 else str(numeric_value)
         except (ValueError, TypeError):
             return '1'
     
-    return str(value) if value else ''
+    return value
 
 
 def get_price_with_fallback(price_value, price_type):
     """Handles price with fallback logic."""
-    types_requiring_price = ['FIXED_PRICE', 'BIDDING_FROM']
-    
-    if price_type in types_requiring_price:
+    if price_type in TYPES_REQUIRING_PRICE:
         if not price_value:
             return 1
         try:
-            numeric_price = int(float(price_value))
+            numeric_price = to_int(price_value)
             return 1 if numeric_price <= 0 else numeric_price
         except (ValueError, TypeError):
             return 1
@@ -206,46 +472,52 @@ def get_price_with_fallback(price_value, price_type):
 
 
 def replace_text_tags(record):
-    """Replaces template tags in text fields."""
-    memory = {}
-    
-    tag_mapping = {
-        '{{Centre_description}}': lambda: memory.get('Centre_description', ''),
-        '{{center_name}}': lambda: clean_text(record.get('center_name', '')),
-        '{{price}}': lambda: clean_text(record.get('price (mirror)', '')),
-        '{{currency}}': lambda: 'EUR',
-        '{{area_Min}}': lambda: clean_text(record.get('area_sqm', '')),
-        '{{area_Max}}': lambda: clean_text(record.get('area_max', ''))
+    """Replaces template tags in text fields.
+    
+    Returns the record itself when it has no tags, otherwise a shallow copy
+    with the text fields replaced. The input is never modified, since sheet
+    records are shared with the caches.
+    """
+    # Most rows carry no tags at all; skip the per-field work
+    if not any('{{' in str(record.get(field) or '') for field in TAG_TEXT_FIELDS):
+        return record
+    
+    values = {
+        '{{Centre_description}}': '',
+        '{{center_name}}': clean_text(record.get('center_name', '')),
+        '{{price}}': clean_text(record.get('price (mirror)', '')),
+        '{{currency}}': 'EUR',
+        '{{area_Min}}': clean_text(record.get('area_sqm', '')),
+        '{{area_Max}}': clean_text(record.get('area_max', ''))
     }
     
     def replace_tags_in_text(text):
-        if not text:
+        if not text or '{{' not in str(text):
             return text, []
         
-        result = str(text)
-        replacements = []
+        replacements = {}
         
-        for tag, get_value in tag_mapping.items():
-            if tag in result:
-                value = get_value()
-                result = result.replace(tag, value)
-                replacements.append(f"{tag} -> {value}")
+        def substitute(match):
+            tag = match.group(0)
+            value = values[tag]
+            replacements[tag] = f"{tag} -> {value}"
+            return value
         
-        return result, replacements
+        result = TAG_RE.sub(substitute, str(text))
+        return result, list(replacements.values())
     
     # Process fields in order
     title, title_rep = replace_tags_in_text(record.get('title', ''))
-    memory['title'] = title
     
+    # {{Centre_description}} resolves to the already-processed centre text,
+    # so it stays empty in the title and is filled in for later fields
     centre_desc, centre_rep = replace_tags_in_text(record.get('Centre_description', ''))
-    memory['Centre_description'] = centre_desc
+    values['{{Centre_description}}'] = str(centre_desc) if centre_desc else ''
     
     # New: process preheader after Centre_description
     preheader, preheader_rep = replace_tags_in_text(record.get('preheader', ''))
-    memory['preheader'] = preheader
 
     description, desc_rep = replace_tags_in_text(record.get('description', ''))
-    memory['description'] = description
     
     # Log replacements
     all_rep = title_rep + centre_rep + preheader_rep + desc_rep
@@ -253,188 +525,412 @@ def replace_text_tags(record):
         vendor_id = record.get('vendorId', 'Unknown')
         logger.info(f"Replacements for {vendor_id}: {', '.join(all_rep)}")
     
-    updated_record = record.copy()
-    updated_record['title'] = title
-    updated_record['Centre_description'] = centre_desc
-    updated_record['preheader'] = preheader
-    updated_record['description'] = description
+    return {
+        **record,
+        'title': title,
+        'Centre_description': centre_desc,
+        'preheader': preheader,
+        'description': description
+    }
+
+
+def find_invalid_xml_field(ad_data):
+    """Returns the name of the first ad field lxml could not serialize, or None."""
+    search = INVALID_XML_CHARS_RE.search
+    for field in ("vendorId", "title", "description", "url"):
+        if ad_data[field] and search(ad_data[field]):
+            return field
+    if any(search(img_url) for img_url in ad_data["images"]):
+        return "images"
+    if any(search(key) or search(value) for key, value in ad_data["attributes"]):
+        return "attributes"
+    return None
+
+
+def process_record(row):
+    """Validates one (index, record) row and returns its ad data as plain values.
+    
+    Expects active rows only (see is_available). Uses no lxml objects so it
+    can run in a worker process.
+    """
+    i, record = row
+    row_num = i + 2
+    raw_vendor_id = record.get('vendorId')
+    vendor_id = raw_vendor_id or f'ROW-{row_num}'
+    
+    try:
+        # Validate before the tag pass, so rows missing fields skip it; a tag
+        # can still resolve to nothing, so tagged rows are checked again after
+        is_valid, error_msg = validate_record(record)
+        if is_valid:
+            tagged_record = replace_text_tags(record)
+            if tagged_record is not record:
+                record = tagged_record
+                is_valid, error_msg = validate_record(record)
+        if not is_valid:
+            reason = f"Row {row_num} ({vendor_id}): {error_msg}"
+            logger.debug(reason)
+            return {"row_num": row_num, "vendorId": vendor_id, "reason": reason}
+        
+        get = record.get
+        
+        # Normalized once; the validator and the price fallback both use it
+        price_type = get('priceType')
+        if price_type not in XSD_ALLOWED_PRICE_TYPES:
+            price_type = clean_text(price_type).upper()
+        
+        is_xsd_valid, xsd_error, category_id = validate_xsd_constraints(record, price_type)
+        if not is_xsd_valid:
+            reason = f"Row {row_num} ({vendor_id}): XSD error - {xsd_error}"
+            logger.debug(reason)
+            return {"row_num": row_num, "vendorId": vendor_id, "reason": reason}
+        
+        # Combine preheader + description: preheader first, then a blank paragraph, then description
+        combined_description_source = get('description')
+        preheader_text = get('preheader')
+        preheader_text = str(preheader_text).strip() if preheader_text else ''
+        if preheader_text:
+            base_desc = str(combined_description_source or '').strip()
+            combined_description_source = f"{preheader_text}\n\n{base_desc}" if base_desc else preheader_text
+            logger.debug("Prepended preheader to description for vendorId=%s", vendor_id)
+        
+        # Images
+        all_images = [img_url for img_url in map(clean_url, map(get, ALL_IMAGE_COLUMNS)) if img_url]
+        
+        # Attributes
+        found_attrs = []
+        for attr_key in ATTRIBUTE_COLUMNS:
+            attr_raw = get(attr_key)
+            if attr_raw is not None:
+                original = clean_text(attr_raw)
+                final = get_attribute_value_with_fallback(attr_key, original)
+                if final:
+                    found_attrs.append((attr_key, final))
+        
+        ad_data = {
+            "vendorId": clean_text(raw_vendor_id),
+            "title": clean_text(get('title')),
+            "description": format_text_for_marktplaats(combined_description_source),
+            "categoryId": str(category_id),
+            "priceType": price_type,
+            "price": str(get_price_with_fallback(get('price'), price_type)),
+            "url": clean_url(get('url')),
+            "images": all_images,
+            "attributes": found_attrs
+        }
+        
+        # Compact ads are rendered as plain strings that lxml never checks, so
+        # characters XML cannot carry must be caught here
+        invalid_field = find_invalid_xml_field(ad_data)
+        if invalid_field:
+            reason = f"Row {row_num} ({vendor_id}): control character in '{invalid_field}'"
+            logger.debug(reason)
+            return {"row_num": row_num, "vendorId": vendor_id, "reason": reason}
+        
+        return {"row_num": row_num, "vendorId": vendor_id, "ad": ad_data}
+        
+    except Exception as e:
+        reason = f"Row {row_num} ({vendor_id}): {type(e).__name__} - {str(e)}"
+        logger.error(reason)
+        return {"row_num": row_num, "vendorId": vendor_id, "reason": reason}
+
+
+def use_cdata(description):
+    """True if a description should be written as a CDATA section."""
+    # CDATA only when there is markup to protect, and never around a ']]>' it
+    # cannot contain; everything else is written as escaped text
+    return ('<' in description or '&' in description) and ']]>' not in description
+
+
+def build_ad_element(ad_data):
+    """Builds a detached <ad> element from process_record output."""
+    SubElement = etree.SubElement
+    ad = etree.Element(TAG_AD, nsmap=NSMAP)
+    
+    SubElement(ad, TAG_VENDOR_ID).text = ad_data["vendorId"]
+    SubElement(ad, TAG_TITLE).text = ad_data["title"]
+    description = ad_data["description"]
+    if use_cdata(description):
+        description = etree.CDATA(description)
+    SubElement(ad, TAG_DESCRIPTION).text = description
+    SubElement(ad, TAG_CATEGORY_ID).text = ad_data["categoryId"]
+    SubElement(ad, TAG_PRICE_TYPE).text = ad_data["priceType"]
+    SubElement(ad, TAG_PRICE).text = ad_data["price"]
+    
+    if ad_data["url"]:
+        SubElement(ad, TAG_URL).text = ad_data["url"]
+    
+    if ad_data["images"]:
+        media = SubElement(ad, TAG_MEDIA)
+        for img_url in ad_data["images"]:
+            SubElement(media, TAG_IMAGE, url=img_url)
+    
+    if ad_data["attributes"]:
+        attrs = SubElement(ad, TAG_ATTRIBUTES)
+        for key, value in ad_data["attributes"]:
+            attr = SubElement(attrs, TAG_ATTRIBUTE)
+            SubElement(attr, TAG_ATTRIBUTE_NAME).text = key
+            SubElement(attr, TAG_ATTRIBUTE_VALUE).text = value
     
-    return updated_record
+    return ad
+
+
+def escape_xml_text(text):
+    """Escapes element text the way lxml does."""
+    # str.replace returns the same string when there is nothing to replace
+    return text.replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;').replace('\r', '&#13;')
+
 
+def escape_xml_attribute(value):
+    """Escapes a double-quoted attribute value the way lxml does."""
+    return (escape_xml_text(value).replace('"', '&quot;')
+            .replace('\n', '&#10;').replace('\t', '&#9;'))
 
-def generate_xml_feed(records):
-    """Generates XML feed."""
-    ns = "http://admarkt.marktplaats.nl/schemas/1.0"
-    root = etree.Element(f"{{{ns}}}ads", nsmap={'admarkt': ns})
+
+def render_ad(ad_data):
+    """Renders one <ad> from process_record output as an XML string.
+    
+    Same string as etree.tostring(build_ad_element(ad_data)) without the
+    namespace declaration that <ads> already carries, built by string
+    formatting instead of one lxml call per element. Values must already be
+    free of characters XML cannot carry (see find_invalid_xml_field).
+    """
+    description = ad_data["description"]
+    if use_cdata(description):
+        description = f"<![CDATA[{description}]]>"
+    else:
+        description = escape_xml_text(description)
+    
+    parts = [
+        "<admarkt:ad><admarkt:vendorId>", escape_xml_text(ad_data["vendorId"]),
+        "</admarkt:vendorId><admarkt:title>", escape_xml_text(ad_data["title"]),
+        "</admarkt:title><admarkt:description>", description,
+        "</admarkt:description><admarkt:categoryId>", escape_xml_text(ad_data["categoryId"]),
+        "</admarkt:categoryId><admarkt:priceType>", escape_xml_text(ad_data["priceType"]),
+        "</admarkt:priceType><admarkt:price>", escape_xml_text(ad_data["price"]),
+        "</admarkt:price>",
+    ]
+    
+    if ad_data["url"]:
+        parts += ("<admarkt:url>", escape_xml_text(ad_data["url"]), "</admarkt:url>")
+    
+    if ad_data["images"]:
+        parts.append("<admarkt:media>")
+        for img_url in ad_data["images"]:
+            parts += ('<admarkt:image url="', escape_xml_attribute(img_url), '"/>')
+        parts.append("</admarkt:media>")
     
+    if ad_data["attributes"]:
+        parts.append("<admarkt:attributes>")
+        for key, value in ad_data["attributes"]:
+            parts += ("<admarkt:attribute><admarkt:attributeName>", escape_xml_text(key),
+                      "</admarkt:attributeName><admarkt:attributeValue>", escape_xml_text(value),
+                      "</admarkt:attributeValue></admarkt:attribute>")
+        parts.append("</admarkt:attributes>")
+    
+    parts.append("</admarkt:ad>")
+    return ''.join(parts)
+
+
+def render_ad_pretty(ad_data):
+    """Renders one <ad> indented one level under <ads>, for PRETTY_XML debugging output.
+    
+    Like render_ad, it leaves the namespace declaration to <ads>.
+    """
+    ad = build_ad_element(ad_data)
+    etree.indent(ad, level=1)
+    xml = etree.tostring(ad, encoding='unicode').replace(f' xmlns:admarkt="{NS}"', '', 1)
+    return f"  {xml}\n"
+
+
+def usable_cpu_count():
+    """Returns how many CPUs this process may run on.
+    
+    os.cpu_count() reports the host's CPUs, which overstates what a container
+    limited by an affinity mask can use.
+    """
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        # sched_getaffinity is not available on every platform (e.g. macOS)
+        return os.cpu_count() or 1
+
+
+def iter_processed_records(rows):
+    """Runs process_record over (index, record) rows, in a process pool for large sheets."""
+    workers = usable_cpu_count()
+    # With a single CPU the pool only adds pickling and IPC to the same work
+    if len(rows) < PARALLEL_MIN_ROWS or workers < 2:
+        yield from map(process_record, rows)
+        return
+    
+    # A few chunks per usable CPU balances load without paying IPC per handful of rows
+    chunksize = max(64, len(rows) // (workers * 4))
+    logger.info(f"Processing {len(rows)} rows in parallel ({workers} workers, chunks of {chunksize})")
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        # Results come back in row order; each ad is written as soon as it arrives
+        yield from executor.map(process_record, rows, chunksize=chunksize)
+
+
+def file_digest(path):
+    """Returns a short blake2b hex digest of a file's contents."""
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def read_text_file(path):
+    """Returns a small text file's stripped contents, or None if it is missing."""
+    try:
+        with open(path) as f:
+            return f.read().strip()
+    except FileNotFoundError:
+        return None
+
+
+def write_gzip_copy(path):
+    """Writes path + '.gz' next to the file, swapping it in atomically."""
+    gz_tmp_path = f"{path}.gz.tmp"
+    with open(path, 'rb') as src, gzip.open(gz_tmp_path, 'wb', compresslevel=6) as dst:
+        shutil.copyfileobj(src, dst, 1 << 20)
+    os.replace(gz_tmp_path, f"{path}.gz")
+
+
+def generate_xml_feed(records, output_path, progress=None):
+    """Generates XML feed, writing each ad to output_path as it is rendered.
+    
+    If a progress dict is given, its rows_done count is updated per row.
+    """
     processed_count = 0
     skipped_count = 0
     error_details = []
     
-    for i, record in enumerate(records):
-        row_num = i + 2
-        vendor_id = record.get('vendorId') or f'ROW-{row_num}'
-        
-        try:
-            # Skip inactive
-            available = str(record.get('Available', '')).strip().upper()
-            if available not in ['TRUE', 'YES', '1']:
-                continue
-            
-            # Replace tags
-            record = replace_text_tags(record)
-            
-            # Validate
-            is_valid, error_msg = validate_record(record)
-            if not is_valid:
-                reason = f"Row {row_num} ({vendor_id}): {error_msg}"
-                logger.warning(reason)
-                error_details.append({"vendorId": vendor_id, "reason": reason})
-                skipped_count += 1
-                continue
-            
-            is_xsd_valid, xsd_error = validate_xsd_constraints(record)
-            if not is_xsd_valid:
-                reason = f"Row {row_num} ({vendor_id}): XSD error - {xsd_error}"
-                logger.warning(reason)
+    # Write to a temp file and swap it in, so readers never see a partial feed
+    tmp_path = f"{output_path}.tmp"
+    
+    # Inactive rows are dropped up front so they are never sent to pool workers
+    active_rows = [(i, record) for i, record in enumerate(records) if is_available(record.get('Available', ''))]
+    if progress is not None:
+        progress['total_rows'] = len(active_rows)
+    
+    render = render_ad_pretty if PRETTY_XML else render_ad
+    
+    try:
+        with open(tmp_path, 'w', encoding='utf-8', newline='') as f:
+            f.write(FEED_HEADER)
+            if PRETTY_XML:
+                f.write('\n')
+            for rows_done, result in enumerate(iter_processed_records(active_rows), 1):
+                if progress is not None:
+                    progress['rows_done'] = rows_done
+                
+                vendor_id = result["vendorId"]
+                reason = result.get("reason")
+                
+                if not reason:
+                    try:
+                        # Rendered in full before writing, so a failing ad leaves nothing behind
+                        f.write(render(result["ad"]))
+                        processed_count += 1
+                        continue
+                    except Exception as e:
+                        reason = f"Row {result['row_num']} ({vendor_id}): {type(e).__name__} - {str(e)}"
+                        logger.error(reason)
+                
                 error_details.append({"vendorId": vendor_id, "reason": reason})
                 skipped_count += 1
-                continue
-            
-            # Build XML
-            ad = etree.SubElement(root, f"{{{ns}}}ad")
-            
-            etree.SubElement(ad, f"{{{ns}}}vendorId").text = clean_text(record.get('vendorId'))
-            etree.SubElement(ad, f"{{{ns}}}title").text = clean_text(record.get('title'))
-            
-            # Combine preheader + description: preheader first, then a blank paragraph, then description
-            combined_description_source = record.get('description')
-            preheader_text = record.get('preheader')
-            if preheader_text and str(preheader_text).strip():
-                base_desc = str(combined_description_source or '')
-                combined_description_source = f"{str(preheader_text).strip()}\n\n{base_desc.strip()}" if base_desc.strip() else str(preheader_text).strip()
-                logger.debug("Prepended preheader to description for vendorId=%s", record.get('vendorId'))
-
-            formatted_desc = format_text_for_marktplaats(combined_description_source)
-            etree.SubElement(ad, f"{{{ns}}}description").text = etree.CDATA(formatted_desc)
-            
-            etree.SubElement(ad, f"{{{ns}}}categoryId").text = str(int(float(record.get('categoryId'))))
-            
-            price_type = clean_text(record.get('priceType')).upper()
-            etree.SubElement(ad, f"{{{ns}}}priceType").text = price_type
-            
-            price = get_price_with_fallback(record.get('price'), price_type)
-            etree.SubElement(ad, f"{{{ns}}}price").text = str(price)
-            
-            if record.get('url') and is_valid_url(record.get('url')):
-                etree.SubElement(ad, f"{{{ns}}}url").text = clean_text(record.get('url'))
-            
-            # Images
-            all_images = []
-            if record.get('image_link') and is_valid_url(record.get('image_link')):
-                all_images.append(clean_text(record.get('image_link')))
-            
-            for img_col in IMAGE_COLUMNS:
-                img_url = record.get(img_col)
-                if img_url and is_valid_url(img_url):
-                    all_images.append(clean_text(img_url))
-            
-            if all_images:
-                media = etree.SubElement(ad, f"{{{ns}}}media")
-                for img_url in all_images:
-                    etree.SubElement(media, f"{{{ns}}}image", url=img_url)
-            
-            # Attributes
-            found_attrs = []
-            for attr_key in ATTRIBUTE_COLUMNS:
-                if record.get(attr_key) is not None:
-                    original = clean_text(record.get(attr_key))
-                    final = get_attribute_value_with_fallback(attr_key, original)
-                    if final:
-                        found_attrs.append((attr_key, final))
-            
-            if found_attrs:
-                attrs = etree.SubElement(ad, f"{{{ns}}}attributes")
-                for key, value in found_attrs:
-                    attr = etree.SubElement(attrs, f"{{{ns}}}attribute")
-                    etree.SubElement(attr, f"{{{ns}}}attributeName").text = key
-                    etree.SubElement(attr, f"{{{ns}}}attributeValue").text = value
-            
-            processed_count += 1
-            
-        except Exception as e:
-            reason = f"Row {row_num} ({vendor_id}): {type(e).__name__} - {str(e)}"
-            logger.error(reason)
-            error_details.append({"vendorId": vendor_id, "reason": reason})
-            skipped_count += 1
+            f.write(FEED_FOOTER)
+    except Exception:
+        # Don't leave a half-written temp file next to the live feed
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
     
+    etag = file_digest(tmp_path)
+    etag_path = f"{output_path}.etag"
+    changed = not (etag == read_text_file(etag_path) and os.path.exists(output_path))
+    if not changed:
+        # Same bytes as the live feed: keep its mtime so fetchers keep getting 304s
+        os.remove(tmp_path)
+        logger.info("Feed content unchanged; keeping existing file")
+        if not os.path.exists(f"{output_path}.gz"):
+            write_gzip_copy(output_path)
+    else:
+        os.replace(tmp_path, output_path)
+        write_gzip_copy(output_path)
+        with open(f"{etag_path}.tmp", 'w') as f:
+            f.write(etag)
+        os.replace(f"{etag_path}.tmp", etag_path)
     logger.info(f"XML generation complete. Processed: {processed_count}, Skipped: {skipped_count}")
+    # Per-row reasons are logged at DEBUG; one summary line keeps log volume flat
+    if error_details:
+        first_reasons = "; ".join(d["reason"] for d in error_details[:10])
+        logger.warning(f"Skipped {skipped_count} rows; first {min(skipped_count, 10)}: {first_reasons}")
     
     return {
-        "xml_content": etree.tostring(root, pretty_print=True, xml_declaration=True, encoding='UTF-8'),
+        "xml_path": output_path,
+        "etag": etag,
+        "changed": changed,
         "processed_count": processed_count,
         "skipped_count": skipped_count,
         "error_details": error_details
     }
 
 
-def save_feed_locally(xml_content):
-    """Saves XML locally."""
-    try:
-        latest_path = os.path.join(XML_STORAGE_DIR, "latest.xml")
-        with open(latest_path, 'wb') as f:
-            f.write(xml_content)
-        
-        logger.info("Feed saved locally as latest.xml")
-        return {"filename": "latest.xml", "local_path": latest_path}
-    except Exception as e:
-        logger.error(f"Local save error: {e}")
-        raise
-
-
-def upload_feed_to_cloudinary(xml_content):
-    """Uploads to Cloudinary."""
+def upload_feed_to_cloudinary(xml_path, etag=None):
+    """Uploads the feed file to Cloudinary in chunks, remembering the uploaded etag."""
     if not all([cloudinary_cloud_name, cloudinary_api_key, cloudinary_api_secret]):
         raise ConnectionError("Cloudinary not configured")
     
     try:
-        result = cloudinary.uploader.upload(
-            file=xml_content,
+        result = cloudinary.uploader.upload_large(
+            xml_path,
+            chunk_size=CLOUDINARY_CHUNK_SIZE,
             resource_type="raw",
             public_id="marktplaats_latest",
             folder="XMLs/Netherlands/Marktplaats",
             overwrite=True
         )
         logger.info(f"Uploaded to Cloudinary: {result.get('secure_url')}")
+        if etag:
+            _LAST_UPLOAD.update(etag=etag, result=result)
         return result
     except Exception as e:
         logger.error(f"Cloudinary upload error: {e}")
         raise
 
 
-@app.route('/generate-feed')
-def generate_and_upload_feed():
-    """Main endpoint."""
+def json_response(payload, status=200):
+    """Builds a JSON response serialized with orjson."""
+    return app.response_class(orjson.dumps(payload), mimetype='application/json'), status
+
+
+def run_feed_generation(job_id=None):
+    """Fetches the sheet, writes the feed and starts its upload. Returns (payload, status)."""
     try:
         logger.info("Starting feed generation...")
+        _FEED_PROGRESS.update(stage='fetching', rows_done=0, total_rows=0)
         records = get_sheet_data()
         
-        generation_result = generate_xml_feed(records)
-        local_save = save_feed_locally(generation_result["xml_content"])
-        
-        cloudinary_result = None
-        cloudinary_error = None
-        
-        try:
-            cloudinary_result = upload_feed_to_cloudinary(generation_result["xml_content"])
-        except Exception as e:
-            cloudinary_error = str(e)
-            logger.warning(f"Cloudinary upload failed: {cloudinary_error}")
+        cached = records is _LAST_GENERATION['records'] and os.path.exists(LATEST_XML_PATH)
+        if cached:
+            # Same rows as the last run, so latest.xml already holds their feed
+            generation_result = dict(_LAST_GENERATION['result'], changed=False)
+            logger.info("Sheet data unchanged since the last run; reusing latest.xml")
+        else:
+            _FEED_PROGRESS.update(stage='generating', total_rows=len(records))
+            generation_result = generate_xml_feed(records, LATEST_XML_PATH, progress=_FEED_PROGRESS)
+            _LAST_GENERATION.update(records=records, result=generation_result)
+            logger.info("Feed saved locally as latest.xml")
         
         response = {
             "status": "success",
             "message": "Feed generated and saved locally.",
             "local_feed_url": "/xml",
+            "feed_changed": generation_result["changed"],
+            "cached": cached,
             "stats": {
                 "total_rows": len(records),
                 "added_to_xml": generation_result["processed_count"],
@@ -443,26 +939,148 @@ def generate_and_upload_feed():
             }
         }
         
-        if cloudinary_result:
-            response["cloudinary_feed_url"] = cloudinary_result.get('secure_url')
-            response["message"] += " Uploaded to Cloudinary."
-        elif cloudinary_error:
-            response["cloudinary_error"] = cloudinary_error
+        # The CDN upload is slow and optional; don't hold the result back for it
+        if all([cloudinary_cloud_name, cloudinary_api_key, cloudinary_api_secret]):
+            if generation_result["etag"] == _LAST_UPLOAD['etag']:
+                # Cloudinary already has these exact bytes
+                upload = Future()
+                upload.set_result(_LAST_UPLOAD['result'])
+                response["cloudinary_feed_url"] = _LAST_UPLOAD['result'].get('secure_url')
+                response["message"] += " Unchanged since the last Cloudinary upload."
+            else:
+                upload = UPLOAD_EXECUTOR.submit(upload_feed_to_cloudinary, LATEST_XML_PATH, generation_result["etag"])
+                response["message"] += " Cloudinary upload started."
+            with _JOBS_LOCK:
+                _UPLOADS[job_id] = upload
+                while len(_UPLOADS) > MAX_TRACKED_JOBS:
+                    _UPLOADS.popitem(last=False)
+            response["cloudinary_status_url"] = f"/cloudinary-status/{job_id}"
+        else:
+            response["cloudinary_error"] = "Cloudinary not configured"
         
-        return jsonify(response), 200
+        return response, 200
         
     except Exception as e:
         logger.error(f"Feed generation failed: {e}")
-        return jsonify({"status": "error", "message": str(e)}), 500
+        return {"status": "error", "message": str(e)}, 500
+    finally:
+        _FEED_PROGRESS['stage'] = 'idle'
+
+
+def stream_feed_job(job_id, future):
+    """Yields NDJSON progress lines until the job finishes, then its result."""
+    while True:
+        try:
+            payload, status = future.result(timeout=PROGRESS_STREAM_INTERVAL)
+        except FutureTimeoutError:
+            # Regular output keeps proxies from closing an idle connection
+            yield orjson.dumps({"status": "running", "job_id": job_id, **_FEED_PROGRESS}) + b"\n"
+            continue
+        yield orjson.dumps({**payload, "job_id": job_id, "http_status": status}) + b"\n"
+        return
+
+
+def submit_feed_job():
+    """Starts a background feed generation, or returns the one already running."""
+    with _JOBS_LOCK:
+        for job_id, future in reversed(_JOBS.items()):
+            if not future.done():
+                return job_id
+        
+        job_id = uuid.uuid4().hex
+        _FEED_PROGRESS.update(stage='queued', rows_done=0, total_rows=0)
+        _JOBS[job_id] = FEED_EXECUTOR.submit(run_feed_generation, job_id)
+        while len(_JOBS) > MAX_TRACKED_JOBS:
+            _JOBS.popitem(last=False)
+        return job_id
+
+
+@app.route('/generate-feed')
+def generate_and_upload_feed():
+    """Main endpoint. Runs in the background; pass ?wait=1 to block until done,
+    or ?stream=1 to receive NDJSON progress lines while it runs."""
+    job_id = submit_feed_job()
+    
+    if request.args.get('stream') == '1':
+        with _JOBS_LOCK:
+            future = _JOBS[job_id]
+        return Response(stream_with_context(stream_feed_job(job_id, future)),
+                        mimetype='application/x-ndjson')
+    
+    if request.args.get('wait') == '1':
+        with _JOBS_LOCK:
+            future = _JOBS[job_id]
+        payload, status = future.result()
+        return json_response({**payload, "job_id": job_id}, status)
+    
+    return json_response({
+        "status": "accepted",
+        "job_id": job_id,
+        "job_url": f"/job/{job_id}",
+        "local_feed_url": "/xml"
+    }, 202)
+
+
+@app.route('/job/<job_id>')
+def feed_job_status(job_id):
+    """Reports the state of a background feed generation."""
+    with _JOBS_LOCK:
+        future = _JOBS.get(job_id)
+    
+    if future is None:
+        return json_response({"error": "Unknown job id."}, 404)
+    if not future.done():
+        return json_response({"status": "running", "job_id": job_id, **_FEED_PROGRESS}, 200)
+    
+    payload, status = future.result()
+    return json_response({**payload, "job_id": job_id}, status)
+
+
+@app.route('/cloudinary-status/<job_id>')
+def cloudinary_upload_status(job_id):
+    """Reports the Cloudinary upload started by a feed generation job."""
+    with _JOBS_LOCK:
+        future = _UPLOADS.get(job_id)
+    
+    if future is None:
+        return json_response({"error": "No upload for this job id."}, 404)
+    if not future.done():
+        return json_response({"status": "uploading", "job_id": job_id}, 200)
+    
+    try:
+        result = future.result()
+    except Exception as e:
+        return json_response({"status": "error", "job_id": job_id, "cloudinary_error": str(e)}, 502)
+    return json_response({"status": "success", "job_id": job_id, "cloudinary_feed_url": result.get('secure_url')}, 200)
 
 
 @app.route('/xml')
 def serve_xml():
     """Serves XML file."""
     try:
-        return send_from_directory(XML_STORAGE_DIR, "latest.xml", as_attachment=False)
+        # ETag/Last-Modified let feed fetchers revalidate and get a 304. The
+        # content-hash ETag stays the same when a regeneration changes nothing
+        etag = read_text_file(LATEST_ETAG_PATH)
+        
+        if request.accept_encodings['gzip'] and os.path.exists(os.path.join(XML_STORAGE_DIR, LATEST_GZIP_NAME)):
+            response = send_from_directory(
+                XML_STORAGE_DIR, LATEST_GZIP_NAME, mimetype='application/xml',
+                # Clients decode the gzip, so name the file they end up with
+                download_name="latest.xml",
+                conditional=True, etag=f"{etag}-gzip" if etag else True,
+                max_age=XML_CACHE_MAX_AGE
+            )
+            response.headers['Content-Encoding'] = 'gzip'
+        else:
+            response = send_from_directory(
+                XML_STORAGE_DIR, "latest.xml", as_attachment=False,
+                conditional=True, etag=etag or True,
+                max_age=XML_CACHE_MAX_AGE
+            )
+        response.vary.add('Accept-Encoding')
+        return response
     except FileNotFoundError:
-        return jsonify({"error": "No XML available. Generate feed first."}), 404
+        return json_response({"error": "No XML available. Generate feed first."}, 404)
 
 
 @app.route('/xml-debug')
@@ -471,30 +1089,61 @@ def serve_xml_debug():
     return serve_xml()
 
 
+@app.route('/invalidate-cache', methods=['POST'])
+def invalidate_cache():
+    """Forces the next feed generation to re-read the sheet."""
+    invalidate_sheet_cache()
+    logger.info("Sheet cache invalidated")
+    return json_response({"status": "success", "message": "Sheet cache cleared."}, 200)
+
+
+@app.route('/cache-info')
+def cache_info():
+    """Reports description formatter cache stats.
+    
+    Only this process's cache is counted. Sheets of PARALLEL_MIN_ROWS or more
+    are formatted in pool workers, whose caches are not included.
+    """
+    return json_response({"format_text_for_marktplaats": format_text_for_marktplaats.cache_info()._asdict()}, 200)
+
+
+@lru_cache(maxsize=4)
+def compile_xml_schema(xsd_path, mtime):
+    """Parses and compiles an XSD once per file version (mtime is the cache key)."""
+    return etree.XMLSchema(etree.parse(xsd_path))
+
+
 def validate_xml_against_schema(xml_path, xsd_path):
     """Validates XML against XSD."""
     try:
-        schema_doc = etree.parse(xsd_path)
-        schema = etree.XMLSchema(schema_doc)
-        xml_doc = etree.parse(xml_path)
-        
-        is_valid = schema.validate(xml_doc)
-        
-        results = {
-            "is_valid": is_valid,
-            "errors": [],
-            "warnings": []
-        }
+        schema = compile_xml_schema(xsd_path, os.path.getmtime(xsd_path))
         
-        if not is_valid:
-            for error in schema.error_log:
-                results["errors"].append({
-                    "line": error.line,
-                    "column": error.column,
-                    "message": error.message,
-                    "domain": error.domain_name,
-                    "type": error.type_name
-                })
+        with _SCHEMA_LOCK:
+            results = {
+                "is_valid": True,
+                "errors": [],
+                "warnings": []
+            }
+            
+            # Valid feeds are checked while parsing, without holding the whole tree
+            try:
+                for _, ad in etree.iterparse(xml_path, tag=TAG_AD, schema=schema):
+                    ad.clear()
+                    while ad.getprevious() is not None:
+                        del ad.getparent()[0]
+            except etree.XMLSyntaxError:
+                # Streaming errors carry no line numbers; validate the parsed
+                # tree to report them with their location
+                results["is_valid"] = schema.validate(etree.parse(xml_path))
+                if not results["is_valid"]:
+                    for error in schema.error_log:
+                        results["errors"].append({
+                            "line": error.line,
+                            "column": error.column,
+                            "message": error.message,
+                            "domain": error.domain_name,
+                            "type": error.type_name
+                        })
         
         return results
         
@@ -510,26 +1159,26 @@ def validate_xml_against_schema(xml_path, xsd_path):
 def validate_current_xml():
     """Validates current XML."""
     try:
-        xml_path = os.path.join(XML_STORAGE_DIR, "latest.xml")
+        xml_path = LATEST_XML_PATH
         xsd_path = "schema.xsd"
         
         if not os.path.exists(xml_path):
-            return jsonify({"error": "No XML file. Generate feed first."}), 404
+            return json_response({"error": "No XML file. Generate feed first."}, 404)
         
         if not os.path.exists(xsd_path):
-            return jsonify({"error": "XSD schema not found."}), 404
+            return json_response({"error": "XSD schema not found."}, 404)
         
         results = validate_xml_against_schema(xml_path, xsd_path)
         
-        return jsonify({
+        return json_response({
             "status": "success",
             "validation_results": results,
             "xml_file": "latest.xml",
             "schema_file": "schema.xsd"
-        }), 200
+        }, 200)
         
     except Exception as e:
-        return jsonify({"status": "error", "message": str(e)}), 500
+        return json_response({"status": "error", "message": str(e)}, 500)
 
 
 @app.route('/')
@@ -540,16 +1189,19 @@ def index():
     <p><em>Updated: October 2025</em></p>
     <h3>Endpoints:</h3>
     <ul>
-        <li><a href="/generate-feed">/generate-feed</a> - Generate and upload</li>
+        <li><a href="/generate-feed">/generate-feed</a> - Generate and upload (background job)</li>
+        <li>/job/&lt;job_id&gt; - Job status</li>
+        <li>/cloudinary-status/&lt;job_id&gt; - Cloudinary upload status</li>
         <li><a href="/xml">/xml</a> - View XML (static URL)</li>
         <li><a href="/xml-debug">/xml-debug</a> - Debug XML</li>
         <li><a href="/validate-xml">/validate-xml</a> - Validate XSD</li>
+        <li><a href="/cache-info">/cache-info</a> - Cache stats</li>
+        <li>POST /invalidate-cache - Clear sheet cache</li>
     </ul>
     '''
 
 
 if __name__ == '__main__':
-    port = int(os.environ.get('PORT', 8080
-
-))
-    app.run(debug=True, host='0.0.0.0', port=port)
+    port = int(os.environ.get('PORT', 8080))
+    # Flask turns on the debugger and reloader when FLASK_DEBUG=1 is set
+    app.run(host='0.0.0.0', port=port)
@@ -0,0 +1,15 @@
+"""
+Gunicorn settings, picked up automatically by `gunicorn app:app`.
+Gunicorn binds to $PORT on its own when it is set.
+"""
+
+import os
+
+# Feed jobs, upload status and the sheet cache live in process memory, so one
+# worker serves every request; threads let it handle them concurrently
+workers = 1
+worker_class = 'gthread'
+threads = int(os.getenv('GUNICORN_THREADS', '8'))
+
+# /generate-feed?wait=1 and ?stream=1 can hold a request for a full generation
+timeout = int(os.getenv('GUNICORN_TIMEOUT', '120'))
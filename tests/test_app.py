@@ -0,0 +1,144 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from lxml import etree
+
+os.environ.setdefault('SPREADSHEET_NAME', 'test-spreadsheet')
+os.environ.setdefault('WORKSHEET_NAME', 'test-worksheet')
+
+import app
+
+
+HEADERS = ['vendorId', 'title', 'description', 'categoryId', 'priceType', 'price',
+           'Available', 'url', 'price (mirror)', 'area_sqm']
+
+
+class FakeWorksheet:
+    """Returns display text for FORMATTED_VALUE reads and raw numbers otherwise."""
+
+    def __init__(self, formatted, unformatted):
+        self.formatted = formatted
+        self.unformatted = unformatted
+
+    def get_values(self, value_render_option='FORMATTED_VALUE'):
+        if value_render_option == 'FORMATTED_VALUE':
+            return self.formatted
+        return self.unformatted
+
+
+class FakeSpreadsheet:
+    def __init__(self, worksheet):
+        self._worksheet = worksheet
+
+    def get_lastUpdateTime(self):
+        return '2025-10-01T00:00:00Z'
+
+    def worksheet(self, name):
+        return self._worksheet
+
+
+class FakeClient:
+    def __init__(self, spreadsheet):
+        self._spreadsheet = spreadsheet
+
+    def open(self, name):
+        return self._spreadsheet
+
+    def open_by_key(self, key):
+        return self._spreadsheet
+
+
+class FetchSheetRecordsTest(unittest.TestCase):
+
+    def setUp(self):
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        patches = [
+            mock.patch.object(app, 'SHEET_CACHE_PATH', os.path.join(tmp_dir.name, 'sheet_cache.pkl')),
+            mock.patch.dict(app._SHEET_CACHE, {'key': None, 'records': None}),
+            mock.patch.dict(app._GS_HANDLES, {'spreadsheet': None, 'worksheet': None}),
+        ]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def fetch(self, formatted_row, unformatted_row):
+        worksheet = FakeWorksheet([HEADERS, formatted_row], [HEADERS, unformatted_row])
+        return app.fetch_sheet_records(FakeClient(FakeSpreadsheet(worksheet)))
+
+    def test_tagged_title_keeps_sheet_display_text(self):
+        records = self.fetch(
+            ['1001', 'Kantoor {{area_Min}} m² voor {{price}}', 'Mooi kantoor', '1', 'FIXED_PRICE',
+             '1500', 'TRUE', 'https://example.com/1', '€ 1.500', '85,5'],
+            [1001, 'Kantoor {{area_Min}} m² voor {{price}}', 'Mooi kantoor', 1, 'FIXED_PRICE',
+             1500, True, 'https://example.com/1', 1500, 85.5],
+        )
+
+        result = app.process_record((0, records[0]))
+
+        self.assertNotIn('reason', result)
+        self.assertEqual(result['ad']['title'], 'Kantoor 85,5 m² voor € 1.500')
+        self.assertEqual(result['ad']['vendorId'], '1001')
+
+
+class ProcessRecordTest(unittest.TestCase):
+
+    def test_tagged_record_is_left_unchanged(self):
+        record = dict(zip(HEADERS, ['1001', 'Kantoor {{area_Min}} m² voor {{price}}',
+                                    'Mooi kantoor {{center_name}}', '1', 'FIXED_PRICE', '1500',
+                                    'TRUE', 'https://example.com/1', '€ 1.500', '85,5']))
+        record['center_name'] = 'Centrum {{price}}'
+        original = dict(record)
+
+        first = app.process_record((0, record))
+        second = app.process_record((0, record))
+
+        self.assertEqual(record, original)
+        self.assertEqual(first, second)
+        self.assertEqual(first['ad']['title'], 'Kantoor 85,5 m² voor € 1.500')
+
+
+def make_ad(**fields):
+    ad = {
+        "vendorId": "V1",
+        "title": "Kantoor",
+        "description": "<p>Mooi kantoor</p>",
+        "categoryId": "1",
+        "priceType": "FIXED_PRICE",
+        "price": "1500",
+        "url": "https://example.com/1",
+        "images": ["https://example.com/1.jpg"],
+        "attributes": [("area_sqm", "85")],
+    }
+    ad.update(fields)
+    return ad
+
+
+class RenderAdTest(unittest.TestCase):
+
+    def assertRendersLikeLxml(self, ad):
+        expected = etree.tostring(app.build_ad_element(ad), encoding='unicode')
+        expected = expected.replace(f' xmlns:admarkt="{app.NS}"', '', 1)
+        self.assertEqual(app.render_ad(ad), expected)
+
+    def test_matches_lxml_serialization(self):
+        ads = [
+            make_ad(),
+            make_ad(url=None, images=[], attributes=[]),
+            make_ad(title="A & B <C> \"quoted\" 'single'\r\nnext line", description="plain text"),
+            make_ad(description=""),
+            make_ad(description="a & b"),
+            make_ad(description="<p>ends with ]]> marker</p>"),
+            make_ad(images=['https://example.com/a.jpg?x=1&y="2"', "https://example.com/\tb\n\r.jpg"]),
+            make_ad(attributes=[("property_type", "Kantoor & <winkel>"), ("deal_type", "Huur\r")]),
+            make_ad(title="Caf\u00e9 \u20ac 1.500 \U0001f600"),
+        ]
+        for ad in ads:
+            with self.subTest(ad=ad):
+                self.assertRendersLikeLxml(ad)
+
+
+if __name__ == '__main__':
+    unittest.main()
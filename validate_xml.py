@@ -8,6 +8,8 @@ from lxml import etree
 import os
 import sys
 
+AD_TAG = "{http://admarkt.marktplaats.nl/schemas/1.0}ad"
+
 def validate_xml_against_schema(xml_file_path, xsd_file_path):
     """
     Validates XML file against XSD schema and returns validation results.
@@ -17,28 +19,33 @@ def validate_xml_against_schema(xml_file_path, xsd_file_path):
         schema_doc = etree.parse(xsd_file_path)
         schema = etree.XMLSchema(schema_doc)
         
-        # Parse XML file
-        xml_doc = etree.parse(xml_file_path)
-        
-        # Validate XML against schema
-        is_valid = schema.validate(xml_doc)
-        
         validation_results = {
-            "is_valid": is_valid,
+            "is_valid": True,
             "errors": [],
             "warnings": []
         }
         
-        if not is_valid:
-            # Get detailed error information
-            for error in schema.error_log:
-                validation_results["errors"].append({
-                    "line": error.line,
-                    "column": error.column,
-                    "message": error.message,
-                    "domain": error.domain_name,
-                    "type": error.type_name
-                })
+        # Validate while parsing; each ad is dropped once read, keeping memory flat
+        try:
+            for _, ad in etree.iterparse(xml_file_path, tag=AD_TAG, schema=schema):
+                ad.clear()
+                while ad.getprevious() is not None:
+                    del ad.getparent()[0]
+        except etree.XMLSyntaxError:
+            # Streaming errors have no line numbers, so validate the parsed tree
+            # to report where each error is
+            validation_results["is_valid"] = schema.validate(etree.parse(xml_file_path))
+            
+            if not validation_results["is_valid"]:
+                # Get detailed error information
+                for error in schema.error_log:
+                    validation_results["errors"].append({
+                        "line": error.line,
+                        "column": error.column,
+                        "message": error.message,
+                        "domain": error.domain_name,
+                        "type": error.type_name
+                    })
         
         return validation_results
         